@@ -1,5 +1,10 @@
 from __future__ import annotations
+import os
+import json
+import pickle
+from copy import copy
 from dataclasses import dataclass
+from functools import lru_cache
 import heapq
 
 import numpy as np
@@ -7,6 +12,7 @@ import torch
 
 from pelutils import log, DataStorage, get_timestamp
 from pelutils.ds import no_grad
+from pelutils.datahandler import SERIALIZATIONS
 
 
 @dataclass
@@ -39,24 +45,109 @@ class TrainResults(DataStorage):
     def __post_init__(self):
         assert self.top_k == sorted(self.top_k), "Top k accuracy list must be monotonically increasing"
 
+    def save(self, loc: str='') -> list[str]:
+        """
+        Saves results. The original parameters are afterwards memory-mapped from disk, so they do not occupy memory during training.
+        As they never change, they are not written again when already memory-mapped from the save location
+        """
+        path = os.path.join(self._get_loc(loc), "orig_params.npy")
+        if isinstance(self.orig_params, np.memmap) and os.path.isfile(path) and os.path.samefile(self.orig_params.filename, path):
+            res = copy(self)
+            del res.orig_params
+            return [*DataStorage.save(res, loc), path]
+        paths = super().save(loc)
+        if self.orig_params is not None:
+            self.orig_params = np.load(path, mmap_mode="c")
+        return paths
+
+    @classmethod
+    def load(cls, loc: str='') -> TrainResults:
+        """ Loads results like DataStorage.load, except that the original parameters are memory-mapped instead of read into memory """
+        # This mirrors DataStorage.load from pelutils 0.6.7 field by field. super().load cannot be used,
+        # as it reads every .npy file fully into memory using np.load without a memory-map mode
+        loc = cls._get_loc(loc)
+        fields = dict()
+        generals = list()
+        for name in cls.__dataclass_fields__:
+            for _, load, ext in SERIALIZATIONS.values():
+                path = os.path.join(loc, f"{name}.{ext}")
+                if os.path.exists(path):
+                    fields[name] = np.load(path, mmap_mode="c") if name == "orig_params" and ext == "npy" else load(path)
+                    break
+            else:
+                generals.append(name)
+
+        any_json = False
+        for name in generals:
+            pickle_path = os.path.join(loc, f"{name}.{cls.pickle_ext}")
+            if os.path.isfile(pickle_path):
+                with open(pickle_path, "rb") as f:
+                    fields[name] = pickle.load(f)
+            else:
+                any_json = True
+        if any_json:
+            with open(os.path.join(loc, cls.json_name), encoding="utf-8") as f:
+                fields.update(json.load(f))
+
+        # Fields that were not saved are set to None as in DataStorage with ignore_missing
+        return cls(**{name: fields.get(name) for name in cls.__dataclass_fields__})
+
+    @staticmethod
+    @no_grad
+    def param_diffs(current: torch.Tensor, orig: np.ndarray, chunk: int=1<<24) -> tuple[float, float]:
+        """
+        Calculates the 1- and 2-norm of current - orig in a single pass over chunks of the parameters,
+        so neither the original parameters nor the difference are ever fully on the device of current
+        """
+        norm1 = torch.zeros((), dtype=torch.float64, device=current.device)
+        sqnorm2 = torch.zeros((), dtype=torch.float64, device=current.device)
+        for start in range(0, len(orig), chunk):
+            diff = current[start:start+chunk] - torch.from_numpy(orig[start:start+chunk]).to(current.device)
+            norm1 += diff.abs().sum(dtype=torch.float64)
+            sqnorm2 += diff.square().sum(dtype=torch.float64)
+        return tuple(torch.stack((norm1, sqnorm2.sqrt())).tolist())
+
+    def add_epoch(self):
+        """ Allocate room for results for another epoch by appending a single row to each epoch-wise array """
+        for field in ("losses", "w_losses", "e_losses", "scaled_loss", "lr", "param_diff_1", "param_diff_2", "runtime"):
+            arr = getattr(self, field)
+            setattr(self, field, np.concatenate((arr, np.zeros((1, *arr.shape[1:])))))
+        for field in ("w_accuracies", "e_accuracies"):
+            arr = getattr(self, field)
+            setattr(self, field, np.concatenate((arr, np.full((1, *arr.shape[1:]), np.nan))))
+
+
+# Largest number of classes for which top_k_accuracy sorts all scores instead of using topk
+_ARGSORT_MAX_CLASSES = 4096
+
+@lru_cache
+def _k_indices(top_k: tuple[int], max_k: int, device: torch.device) -> torch.LongTensor:
+    """ Column indices in cumulative topk hits corresponding to each k. Cached to avoid a host to device copy each call """
+    return torch.LongTensor([min(k, max_k) - 1 for k in top_k]).to(device)
 
 @no_grad
 def top_k_accuracy(
     labels: torch.Tensor,
     scores: torch.Tensor,
     top_k: list[int],
-) -> np.ndarray:
-    """ Calculate top k accuracies for given predictions """
-    largest_k = top_k[-1]
-    idcs = torch.arange(len(labels))
-    k_scores = np.zeros(len(top_k))
-    for k in range(largest_k):
-        argmax = scores.argmax(dim=1)
-        trues = argmax == labels
-        k_scores[[i for i, k_ in enumerate(top_k) if k < k_]] += trues.sum().item()
-        scores[idcs, argmax] = -float("inf")
-
-    return k_scores / len(labels)
-
-
-
+) -> torch.Tensor:
+    """ Calculate top k accuracies for given predictions. The result is kept on the device of scores """
+    # Reductions are faster on contiguous float32 memory, especially on CPU
+    scores = scores.contiguous()
+    if scores.device.type == "cpu" and scores.dtype == torch.float64:
+        scores = scores.float()
+    if list(top_k) == [1]:
+        # argmax is cheaper than topk when only the best prediction is needed
+        return (scores.argmax(dim=1) == labels).sum(dim=0, keepdim=True) / len(labels)
+    # A single topk call gives the largest_k best predictions in descending order.
+    # For moderately sized class dimensions, a full argsort is faster than topk on GPU
+    max_k = min(top_k[-1], scores.shape[1])
+    if scores.shape[1] <= _ARGSORT_MAX_CLASSES:
+        topk_idcs = scores.argsort(dim=1, descending=True)[:, :max_k]
+    else:
+        topk_idcs = scores.topk(max_k, dim=1, sorted=True).indices
+    # As each label can appear at most once, the cumulative sum of hits shows whether it is within the top k
+    cumhits = (topk_idcs == labels.unsqueeze(1)).cumsum(dim=1)
+    # Everything is kept on device, so the caller decides when to synchronize
+    ks = _k_indices(tuple(top_k), topk_idcs.shape[1], scores.device)
+    return cumhits.index_select(1, ks).sum(dim=0) / len(labels)
@@ -84,8 +84,12 @@ class Entities(Words):
 
         ent_pos = torch.full((max_entities, max_entity_span), -1, dtype=torch.int)
         spans = [(s+1, e+1) for s, e in spans] # +1 for [CLS] token added to words
-        for i, (start, end) in enumerate(spans):
-            ent_pos[i, :end-start] = torch.arange(start, end)
+        if spans:
+            # Fill in the positions of all entities at once: Row i contains start_i, start_i+1, ..., end_i-1 followed by -1's
+            starts, ends = torch.tensor(spans, dtype=torch.int).T
+            assert (ends - starts <= max_entity_span).all(), f"Entity spans cannot be longer than the maximum entity span {max_entity_span}"
+            pos = starts.unsqueeze(1) + torch.arange(max_entity_span, dtype=torch.int)
+            ent_pos[:len(spans)] = torch.where(pos < ends.unsqueeze(1), pos, ent_pos[:len(spans)])
 
         return cls(
             ids            = ent_ids,
@@ -112,13 +116,16 @@ class BatchedExamples(Example):
     @staticmethod
     def collate(ex: list[Example], device: torch.device, cut: bool) -> (Words, Entities):
         # Stack the tensors in specific field for each example and send to device
-        tensor_collate = lambda field, subfield, limit: torch.stack(tuple(getattr(getattr(e, field), subfield)[:limit] for e in ex)).to(device)
+        tensor_collate = lambda field, subfield, limit: stack_to_device([getattr(getattr(e, field), subfield)[:limit] for e in ex], device)
 
-        word_N = torch.tensor(tuple(e.words.N for e in ex)).to(device) + 2 # +2 for CLS, SEP
-        ent_N = torch.tensor(tuple(e.entities.N for e in ex)).to(device)
+        word_N = tuple(e.words.N + 2 for e in ex) # +2 for CLS, SEP
+        ent_N = tuple(e.entities.N for e in ex)
         # It is here assumed that all word and entity ids already have been padded to exactly same length (as they have in their build methods)
+        # Limits are found before moving to device to avoid synchronization
         word_limit = max(word_N) if cut else len(ex[0].words.ids)
         ent_limit = max(ent_N) if cut else len(ex[0].entities.ids)
+        word_N = to_device(torch.tensor(word_N), device)
+        ent_N = to_device(torch.tensor(ent_N), device)
         return Words(
             ids             = tensor_collate("words", "ids", word_limit),
             attention_mask  = tensor_collate("words", "attention_mask", word_limit),
@@ -137,6 +144,26 @@ class BatchedExamples(Example):
     def build(cls, ex: list[Example], device: torch.device, cut_extra_padding: bool=True):
         return cls(*cls.collate(ex, device=device, cut=cut_extra_padding))
 
+def to_device(tensor: torch.Tensor, device: torch.device) -> torch.Tensor:
+    """
+    Sends a CPU tensor to device.
+    For CUDA, the tensor is pinned first, so the copy to the device does not block the host
+    """
+    if device.type == "cuda":
+        if not tensor.is_pinned():
+            tensor = tensor.pin_memory()
+        return tensor.to(device, non_blocking=True)
+    return tensor.to(device)
+
+def stack_to_device(tensors: list[torch.Tensor], device: torch.device) -> torch.Tensor:
+    """
+    Stacks tensors and sends the result to device.
+    For CUDA, the tensors are stacked directly into pinned memory, so no extra copy is needed for pinning
+    """
+    stacked = torch.empty((len(tensors), *tensors[0].shape), dtype=tensors[0].dtype, pin_memory=device.type == "cuda")
+    torch.stack(tensors, out=stacked)
+    return to_device(stacked, device)
+
 def get_special_ids(tokenizer: AutoTokenizer) -> (int, int, int):
     """ Returns seperator id, close id and pad id """
     return tuple(tokenizer.convert_tokens_to_ids(t) for t in (tokenizer.sep_token, tokenizer.cls_token, tokenizer.pad_token))
@@ -1,4 +1,5 @@
 from __future__ import annotations
+from functools import lru_cache
 from typing import Any, Type
 
 import torch
@@ -11,6 +12,11 @@ from daluke.ner.data import NERDataset
 from daluke.ner.model import NERDaLUKE
 from daluke.pretrain.model import load_base_model_weights
 
+@lru_cache(maxsize=4)
+def _get_config(base_model: str) -> AutoConfig:
+    """ Configs are cached to avoid reading them again, e.g. when models are loaded more than once. Should not be modified """
+    return AutoConfig.from_pretrained(base_model)
+
 def load_dataset(args: dict[str, Any], metadata: dict[str, Any], device: torch.device) -> NERDataset:
     dataset_cls: Type[NERDataset] = getattr(datasets, args["dataset"])
     dataset = dataset_cls(
@@ -35,7 +41,7 @@ def load_model(
     entity_embedding_size: int=None,
     dropout: float=None,
 ) -> NERDaLUKE:
-    bert_config = AutoConfig.from_pretrained(metadata["base-model"])
+    bert_config = _get_config(metadata["base-model"])
     model = NERDaLUKE(
         metadata.get("output-size", len(dataset.all_labels)),
         bert_config,
@@ -2,6 +2,8 @@ from __future__ import annotations
 from typing import Optional
 from dataclasses import dataclass
 import os
+import json
+import pickle
 
 import torch
 import numpy as np
@@ -12,6 +14,7 @@ import click
 from tqdm import tqdm
 
 from pelutils import log, DataStorage, Levels, set_seeds
+from pelutils.datahandler import SERIALIZATIONS
 
 from daluke.serialize import load_from_archive
 from daluke.ner import load_model, load_dataset
@@ -32,6 +35,35 @@ class GeometryResults(DataStorage):
 
     subfolder = "geometry"
 
+    @classmethod
+    def load(cls, loc: str='') -> GeometryResults:
+        """ Loads results like DataStorage.load, except that arrays are memory-mapped from their .npy files, so they are not read into memory up front """
+        # This mirrors DataStorage.load from pelutils 0.6.7, which cannot be used as it reads .npy files without a memory-map mode
+        loc = cls._get_loc(loc)
+        fields = dict()
+        generals = list()
+        for name in cls.__dataclass_fields__:
+            for _, load, ext in SERIALIZATIONS.values():
+                path = os.path.join(loc, f"{name}.{ext}")
+                if os.path.exists(path):
+                    fields[name] = np.load(path, mmap_mode="r") if ext == "npy" else load(path)
+                    break
+            else:
+                generals.append(name)
+
+        any_json = False
+        for name in generals:
+            pickle_path = os.path.join(loc, f"{name}.{cls.pickle_ext}")
+            if os.path.isfile(pickle_path):
+                with open(pickle_path, "rb") as f:
+                    fields[name] = pickle.load(f)
+            else:
+                any_json = True
+        if any_json:
+            with open(os.path.join(loc, cls.json_name), encoding="utf-8") as f:
+                fields.update(json.load(f))
+        return cls(**fields)
+
 def collect_representations(modelpath: str, device: torch.device, target_device: torch.device, only_positives: bool, fine_tuned: bool) -> tuple[np.ndarray, np.ndarray, list[dict[str, int | list[tuple[int, int]]]]]:
     entity_vocab, metadata, state_dict = load_from_archive(modelpath)
     log("Loading dataset")
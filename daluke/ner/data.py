@@ -1,27 +1,33 @@
 from __future__ import annotations
 import os
+import importlib.util
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
 from typing import Optional
 from enum import IntEnum
+from copy import copy
+from functools import lru_cache
 import math
 from itertools import chain
 
 import numpy as np
 import torch
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Dataset
+from tqdm.contrib.concurrent import process_map
 
 from transformers import AutoTokenizer
 
-try:
-    from danlp.datasets import DDT
-    danlp_available = True
-except ImportError:
-    danlp_available = False
+# danlp is only imported when DaNE is actually loaded, as importing it is slow
+danlp_available = importlib.util.find_spec("danlp") is not None
 
 from pelutils import log
 
-from daluke.data import Entities, Example, BatchedExamples, Words, get_special_ids
+from daluke.data import Entities, Example, BatchedExamples, Words, get_special_ids, stack_to_device
+
+@lru_cache(maxsize=4)
+def _get_tokenizer(base_model: str) -> AutoTokenizer:
+    """ Tokenizers are cached, as loading them is slow and datasets are often instantiated more than once """
+    return AutoTokenizer.from_pretrained(base_model, use_fast=True)
 
 @dataclass
 class NEREntities(Entities):
@@ -33,7 +39,7 @@ class NEREntities(Entities):
     @classmethod
     def build_from_entities(cls, ent: Entities, labels: torch.LongTensor, fullword_spans: list[tuple[int, int]], max_entities: int):
         out_labels = torch.full((max_entities,), -1, dtype=torch.long)
-        out_labels[:len(labels)] = torch.LongTensor(labels)
+        out_labels[:len(labels)] = labels
 
         # Have to be long tensors as we are working with indeces
         start_pos = torch.full((max_entities,), 0, dtype=torch.long)
@@ -73,13 +79,26 @@ class NERBatchedExamples(BatchedExamples):
             N               = entities.N,
             spans           = entities.spans,
             pos             = entities.pos,
-            start_pos       = torch.stack([ex.entities.start_pos[:ent_limit] for ex in examples]).to(device),
-            end_pos         = torch.stack([ex.entities.end_pos[:ent_limit] for ex in examples]).to(device),
-            labels          = torch.stack([ex.entities.labels[:ent_limit] for ex in examples]).to(device),
+            start_pos       = stack_to_device([ex.entities.start_pos[:ent_limit] for ex in examples], device),
+            end_pos         = stack_to_device([ex.entities.end_pos[:ent_limit] for ex in examples], device),
+            labels          = stack_to_device([ex.entities.labels[:ent_limit] for ex in examples], device),
             fullword_spans  = [ex.entities.fullword_spans for ex in examples],
         )
         return cls(words, ner_entities, text_nums)
 
+class IndexedExamples(Dataset):
+    """
+    Gives each example together with its index, such that examples are not copied into a list of (index, example) pairs
+    """
+    def __init__(self, examples: list[NERExample]):
+        self.examples = examples
+
+    def __len__(self) -> int:
+        return len(self.examples)
+
+    def __getitem__(self, i: int) -> tuple[int, NERExample]:
+        return i, self.examples[i]
+
 class Split(IntEnum):
     TRAIN = 0
     DEV = 1
@@ -108,8 +127,9 @@ class NERDataset(ABC):
         self.max_entity_span = max_entity_span
 
         self.label_to_idx = {label: i for i, label in enumerate(self.all_labels)}
+        self._null_idx = self.label_to_idx[self.null_label]
 
-        self.tokenizer = AutoTokenizer.from_pretrained(base_model)
+        self.tokenizer = _get_tokenizer(base_model)
         self.sep_id, self.cls_id, self.pad_id = get_special_ids(self.tokenizer)
 
         # To be set by load method
@@ -122,48 +142,45 @@ class NERDataset(ABC):
     def load(self, **kwargs):
         pass
 
-    def build(self, split: Split, batch_size: int, shuffle: Optional[bool]=None) -> DataLoader:
+    def build(self, split: Split, batch_size: int, shuffle: Optional[bool]=None, build_workers: int=1) -> DataLoader:
         assert self.loaded, "Run .load() first, before building"
-        examples = self._build_examples(split)
-        return DataLoader(list(enumerate(examples)), batch_size=batch_size, collate_fn=self.collate, shuffle=shuffle if shuffle is not None else split==split.TRAIN)
+        examples = self._build_examples(split, build_workers)
+        return DataLoader(IndexedExamples(examples), batch_size=batch_size, collate_fn=self.collate, shuffle=shuffle if shuffle is not None else split==split.TRAIN)
 
     @property
     def all_labels(self) -> list[str]:
         L = list() if self.null_label is None else [self.null_label]
         return [*L, *self.labels]
 
-    def _build_examples(self, split: Split) -> list[NERExample]:
+    def _build_examples(self, split: Split, build_workers: int=1) -> list[NERExample]:
         examples = list()
 
-        for i, (text, annotation, bounds) in enumerate(zip(self.data[split].texts, self.data[split].annotations, self.data[split].sentence_boundaries)):
-            text_token_ids: list[list[int]] = self.tokenizer(text, add_special_tokens=False)["input_ids"]
-            # We might have to split some sentences to respect the maximum sentence length
-            bounds = self._add_extra_sentence_boundaries(bounds, text_token_ids)
-            # TODO: Consider the current sentence splitting: Do we throw away context in situations where we actually have sentence-document information? (Not relevant for DaNE)
-            for j, end in enumerate(bounds):
-                start = bounds[j-1] if j else 0
-                # Flatten structure of [[subwords], [subwords], ... ]
-                word_ids = list(chain(*text_token_ids[start: end]))
-                true_entity_fullword_spans = self._segment_entities(annotation[start: end])
-                # The cumulative length of each word in units of subwords
-                cumlength = np.cumsum([len(t) for t in text_token_ids[start: end]])
-                # Save the spans of entities as they are in the token list
-                true_entity_subword_spans = {(cumlength[s-1] if s else 0, cumlength[e-1]): ann
-                    for (s, e), ann in true_entity_fullword_spans.items()}
-                assert all(e-s <= self.max_entity_span for s, e in true_entity_subword_spans),\
-                        f"Example {i}, sentence {j} contains an entity longer than limit of {self.max_entity_span} tokens. Text:\n\t{text}"
-                assert len(true_entity_subword_spans) < self.max_entities,\
-                        f"Example {i}, sentence {j} contains {len(true_entity_subword_spans)} entities, but only {self.max_entities} are allowed. Text:\n\t{text}"
-
-                all_entity_fullword_spans = self._generate_all_entity_spans(true_entity_fullword_spans, text_token_ids[start: end], cumlength)
-                all_entity_subword_spans = [(cumlength[s-1] if s else 0, cumlength[e-1]) for s, e in all_entity_fullword_spans]
-
+        # Handy for debugging on smaller data set
+        n = len(self.data[split].texts) if self.data_limit is None else self.data_limit + 1
+        texts = self.data[split].texts[:n]
+        # Tokenize the words of all texts in a single call, as the overhead of calling the tokenizer for each text is large
+        words = list(chain(*texts))
+        all_token_ids: list[list[int]] = self.tokenizer(words, add_special_tokens=False)["input_ids"] if words else list()
+        text_starts = np.cumsum([0, *(len(text) for text in texts)])
+        token_ids = [all_token_ids[start:end] for start, end in zip(text_starts[:-1], text_starts[1:])]
+
+        # The texts are processed independently, so this can be spread out over multiple processes
+        text_args = (range(n), texts, self.data[split].annotations[:n], self.data[split].sentence_boundaries[:n], token_ids)
+        if build_workers > 1:
+            # The tokenizer and the data are not needed for processing texts, so they are not sent to the workers
+            processor = copy(self)
+            processor.tokenizer, processor.data = None, dict()
+            processed_texts = process_map(processor._process_text, *text_args, max_workers=build_workers, chunksize=256)
+        else:
+            processed_texts = map(self._process_text, *text_args)
+
+        for i, sentences in enumerate(processed_texts):
+            for word_ids, all_entity_fullword_spans, all_entity_subword_spans, entity_labels in sentences:
+                word_ids = torch.from_numpy(word_ids)
                 # We dont use the entity id: We just use the id feature for their length
                 # TODO: Document why ones
                 entity_ids = torch.ones(len(all_entity_subword_spans), dtype=torch.int)
-                entity_labels = torch.LongTensor(
-                    [self.label_to_idx[true_entity_subword_spans.get(span, self.null_label)] for span in all_entity_subword_spans]
-                )
+                entity_labels = torch.from_numpy(entity_labels)
                 # If there are too many possible spans for self.max_entities, we must divide the sequence into multiple examples
                 for sub_example in range(int(math.ceil(len(all_entity_subword_spans)/self.max_entities))):
                     substart = self.max_entities * sub_example
@@ -176,7 +193,7 @@ class NERDataset(ABC):
                         max_entity_span = self.max_entity_span,
                     )
                     words = Words.build(
-                        torch.IntTensor(word_ids),
+                        word_ids,
                         max_len = self.max_seq_length,
                         sep_id  = self.sep_id,
                         cls_id  = self.cls_id,
@@ -194,11 +211,56 @@ class NERDataset(ABC):
                             text_num = i,
                         )
                     )
-            # Handy for debugging on smaller data set
-            if self.data_limit is not None and i == self.data_limit:
-                break
         return examples
 
+    def _process_text(
+        self,
+        i: int,
+        text: list[str],
+        annotation: list[str],
+        bounds: list[int],
+        text_token_ids: list[list[int]],
+    ) -> list[tuple[np.ndarray, list[tuple[int, int]], list[tuple[int, int]], np.ndarray]]:
+        """
+        Finds word ids, all possible entity spans in full words and subwords, and entity labels for each sentence in a text.
+        Only Python and numpy objects are returned, such that this is cheap to run in another process.
+        """
+        sentences = list()
+        # Flatten structure of [[subwords], [subwords], ... ] into a single buffer for the text which sentences are sliced from
+        text_prefix = self._subword_prefix(text_token_ids)
+        text_word_ids = np.fromiter(chain(*text_token_ids), dtype=np.int32, count=text_prefix[-1])
+        # We might have to split some sentences to respect the maximum sentence length
+        bounds = self._add_extra_sentence_boundaries(bounds, text_token_ids)
+        # TODO: Consider the current sentence splitting: Do we throw away context in situations where we actually have sentence-document information? (Not relevant for DaNE)
+        for j, end in enumerate(bounds):
+            start = bounds[j-1] if j else 0
+            true_entity_fullword_spans = self._segment_entities(annotation[start: end])
+            # The cumulative length of each word in units of subwords
+            cumlength = text_prefix[start+1:end+1] - text_prefix[start]
+            # Save the spans of entities as they are in the token list
+            true_entity_subword_spans = {(cumlength[s-1] if s else 0, cumlength[e-1]): ann
+                for (s, e), ann in true_entity_fullword_spans.items()}
+            assert all(e-s <= self.max_entity_span for s, e in true_entity_subword_spans),\
+                    f"Example {i}, sentence {j} contains an entity longer than limit of {self.max_entity_span} tokens. Text:\n\t{text}"
+            assert len(true_entity_subword_spans) < self.max_entities,\
+                    f"Example {i}, sentence {j} contains {len(true_entity_subword_spans)} entities, but only {self.max_entities} are allowed. Text:\n\t{text}"
+
+            all_entity_fullword_spans = self._generate_all_entity_spans(true_entity_fullword_spans, text_token_ids[start: end], cumlength)
+            all_entity_subword_spans = [(cumlength[s-1] if s else 0, cumlength[e-1]) for s, e in all_entity_fullword_spans]
+            # Look up labels of all spans at once in a table where element (s, e) is the label index of full word span (s, e)
+            label_table = np.full((end-start+1, end-start+1), self._null_idx, dtype=np.int64)
+            for (s, e), ann in true_entity_fullword_spans.items():
+                label_table[s, e] = self.label_to_idx[ann]
+            span_arr = np.array(all_entity_fullword_spans, dtype=np.int64).reshape(-1, 2)
+            entity_labels = label_table[span_arr[:, 0], span_arr[:, 1]]
+            sentences.append((
+                text_word_ids[text_prefix[start]:text_prefix[end]],
+                all_entity_fullword_spans,
+                all_entity_subword_spans,
+                entity_labels,
+            ))
+        return sentences
+
     def collate(self, batch: list[tuple[int, NERExample]]) -> NERBatchedExamples:
         return NERBatchedExamples.build(
             [ex for _, ex in batch],
@@ -207,70 +269,87 @@ class NERDataset(ABC):
         )
 
     def _generate_all_entity_spans(self, true_spans: dict[tuple[int, int], str], token_ids: list[list[int]], cumlength: np.ndarray) -> list[tuple[int, int]]:
-        possible_spans = list()
+        N = len(token_ids)
+        # Element (i, j) is true if the span (i, j) is a true entity
+        is_true = np.zeros((N+1, N+1), dtype=bool)
+        if true_spans:
+            is_true[tuple(np.array(list(true_spans)).T)] = True
+        # Subword length of each span is found from the cumulative length with a leading zero
+        prefix = np.concatenate((np.zeros(1, dtype=cumlength.dtype), cumlength))
+        short_enough = prefix[None, :] - prefix[:, None] <= self.max_entity_span
         # Spans are (0, 1), (0, 2), (0, 3), ... (0, N), (1, 2), (1, 3), ... (N-1, N)
-        for i in range(len(token_ids)):
-            for j in range(i+1, len(token_ids)+1):
-                if (i, j) not in true_spans and (cumlength[j-1] - (cumlength[i-1] if i else 0)) <= self.max_entity_span:
-                    possible_spans.append((i, j))
-        # Make sure we include the true spans. Sort it such that the true spans are not always in the last example
-        return sorted(possible_spans + list(true_spans.keys()))
+        # Make sure we include the true spans. argwhere returns them sorted such that the true spans are not always in the last example
+        possible = np.triu(short_enough | is_true, k=1)
+        return [tuple(span) for span in np.argwhere(possible).tolist()]
 
     def _segment_entities(self, annotation: list[str]) -> dict[tuple[int, int], str]:
         """
         Reads entity annotation in IOB format and finds entity spans mapped to entity type
         """
+        # Split each annotation into tag and type once. The null label is given as (None, None)
+        parsed = [(None, None) if ann == self.null_label else tuple(ann.split("-", 1)) for ann in annotation]
         spans = dict()
         start = None
         ent_type = None
-        for i, ann in enumerate(annotation):
+        for i, (tag, typ_) in enumerate(parsed):
             # Ignore "O"
-            if ann == self.null_label:
+            if tag is None:
                 assert start is None, "Found O label, but another entity was not ended"
                 continue
-            tag, typ_ = ann.split("-")
             # Might be end if either (1) last in sentence or (2) followed by explicit start or (3) followed by another annotation type
-            if i+1 == len(annotation) or annotation[i+1] == self.null_label or\
-                    (next_ann := annotation[i+1].split("-"))[0] == "B" or next_ann[1] != typ_:
+            if i+1 == len(parsed) or parsed[i+1][0] in {None, "B"} or parsed[i+1][1] != typ_:
                 assert ent_type is None or typ_ == ent_type, "Entity seems to change annotation during span - this should not be possible"
                 spans[(i if start is None else start, i+1)] = typ_
                 # We ended entity, look for a new one
                 start = None
                 ent_type = None
             # Might be a beginning if it is either (1) explicitly marked (2) starts sentence (3) follows another annotation type
-            elif tag == "B" or not i or annotation[i-1] == self.null_label or\
-                    annotation[i-1].split("-")[1] != typ_:
+            elif tag == "B" or not i or parsed[i-1][1] != typ_:
                 assert start is None, "Found start entity while another one was not ended"
                 start = i
                 ent_type = typ_
         return spans
 
+    @staticmethod
+    def _subword_prefix(token_ids: list[list[int]]) -> np.ndarray:
+        """
+        Cumulative subword lengths of words with a leading zero, such that the number of subwords in words [a, b) is prefix[b] - prefix[a].
+        int32 is used, as the numbers of subwords are far from its limit
+        """
+        prefix = np.zeros(len(token_ids)+1, dtype=np.int32)
+        np.cumsum(np.fromiter(map(len, token_ids), dtype=np.int32, count=len(token_ids)), out=prefix[1:])
+        return prefix
+
     def _add_extra_sentence_boundaries(self, bounds: list[int], text_token_ids: list[list[int]]) -> list[int]:
-        # Check whether we should add another sentence bound by splitting one of the sentences
-        might_need_split = True
-        while might_need_split:
-            for i, bound in enumerate(bounds):
-                # Sum up subword lengths for this sentence
-                sent_start = bounds[i-1] if i else 0
-                sentence_cumlength = np.cumsum([len(tokens) for tokens in text_token_ids[sent_start:bound]])
-                if sentence_cumlength[-1] + 2 > self.max_seq_length: # +2 for start and end tokens
-                    # Use bool cast to int to find the number of words that give a sum under the limit.
-                    split_candidate = (sentence_cumlength + 2 < self.max_seq_length).sum()
-                    # TODO: Maybe split more intelligently such as checking whether this split candidate breaks up an entity
-                    bounds.insert(i, sent_start + split_candidate)
-                    break
-            else:
-                might_need_split = False
-        return bounds
+        prefix = self._subword_prefix(text_token_ids)
+        # Sweep through the sentences and split each one as many times as needed to respect the maximum length
+        new_bounds = list()
+        sent_start = 0
+        for bound in bounds:
+            while prefix[bound] - prefix[sent_start] + 2 > self.max_seq_length: # +2 for start and end tokens
+                # Find the number of words that give a sum under the limit. The cumulative lengths are sorted, so this can be binary searched
+                sentence_cumlength = prefix[sent_start+1:bound+1] - prefix[sent_start]
+                split_candidate = np.searchsorted(sentence_cumlength, self.max_seq_length - 2)
+                assert split_candidate > 0,\
+                    f"Word {sent_start} has {sentence_cumlength[0]} subwords, which is too long for maximum sequence length {self.max_seq_length}"
+                # TODO: Maybe split more intelligently such as checking whether this split candidate breaks up an entity
+                sent_start += split_candidate
+                new_bounds.append(sent_start)
+            new_bounds.append(bound)
+            sent_start = bound
+        return new_bounds
 
     def document(self, loader: DataLoader, split: Split) -> dict[str, int]:
         """
         To be run after _build_examples to document the resulting data.
         """
         examples = [ex for _, ex in loader.dataset]
-        non_zeros = [(ex.entities.labels[ex.entities.labels != -1] != self.label_to_idx[self.null_label]).float().mean().item() for ex in examples]
+        # All labels are padded to the same length, so the proportions can be computed for all examples at once
+        labels = torch.stack([ex.entities.labels for ex in examples])
+        not_padding = labels != -1
+        non_zeros = ((labels != self._null_idx) & not_padding).sum(dim=1) / not_padding.sum(dim=1)
         log(f"Built dataset of {len(self.data[split].texts)} documents divided into {len(examples)} examples to be forward passed")
-        log(f"Average proportion of spans in each example that have positive labels: {np.mean(non_zeros)*100:.2f}%")
+        log(f"Average proportion of spans in each example that have positive labels: {non_zeros.mean().item()*100:.2f}%")
 
 class DaNE(NERDataset):
     null_label = "O"
@@ -280,6 +359,7 @@ class DaNE(NERDataset):
         # Get all three splits from DaNE and divide them in source texts and annotations
         if not danlp_available:
             raise RuntimeError("DaNE dataset requires installation of the optional requirement `danlp`")
+        from danlp.datasets import DDT
         datasets = DDT().load_as_simple_ner(predefined_splits=True)
         for (texts, annotations), split in zip(datasets, Split):
             self.data[split] = Sequences(
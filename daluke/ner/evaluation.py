@@ -2,10 +2,12 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Union
 from collections import defaultdict
+import contextlib
 import json
 
 import numpy as np
 import torch
+import torch.cuda.amp as amp
 from torch import nn
 from tqdm import tqdm
 import torch.nn.functional as F
@@ -57,14 +59,17 @@ def confusion_matrix(annotations, preds, classes: list[str]) -> dict[str, dict[s
     return confmat
 
 @no_grad
-def evaluate_ner(model: nn.Module, dataloader: torch.utils.data.DataLoader, dataset: NERDataset, device: torch.device, split: Split, also_no_misc=True) -> NER_Results:
+def evaluate_ner(model: nn.Module, dataloader: torch.utils.data.DataLoader, dataset: NERDataset, device: torch.device, split: Split, also_no_misc=True, fp16=False) -> NER_Results:
+    """ Forward passes all examples in dataloader. If fp16, the forward pass is run in mixed precision, which requires CUDA """
     model.eval()
     annotations, texts = dataset.data[split].annotations, dataset.data[split].texts
     span_probs: list[dict[tuple[int, int], np.ndarray]] = list(dict() for _ in range(len(texts)))
     log.debug(f"Forward passing {len(dataloader)} batches")
     for batch in tqdm(dataloader):
-        scores = model(batch)
-        probs = F.softmax(scores, dim=2)
+        with amp.autocast() if fp16 else contextlib.ExitStack():
+            scores = model(batch)
+        # Probabilities are always calculated in full precision
+        probs = F.softmax(scores.float(), dim=2)
         # We save probability distribution, for every possible span in the example
         for idx, (i, spans) in zip(batch.text_nums, enumerate(batch.entities.fullword_spans)):
             span_probs[idx].update({
@@ -54,6 +54,7 @@ ARGUMENTS = {
     "eval":            {"help": "Run evaluation on dev. set after each epoch", "action": "store_true"},
     "quieter":         {"help": "Don't show debug logging", "action": "store_true"},
     "loss-weight":     {"help": "Weight loss contributions by class frequency", "action": "store_true"},
+    "build-workers":   {"help": "Number of processes used to build the dataset", "default": 1, "type": int},
     **DATASET_ARGUMENTS,
 }
 
@@ -76,8 +77,8 @@ def run_experiment(args: dict[str, Any]):
 
     log(f"Loading dataset {args['dataset']} ...")
     dataset = load_dataset(args, metadata, device)
-    dataloader = dataset.build(Split.TRAIN, args["batch_size"])
-    dev_dataloader = dataset.build(Split.DEV, args["batch_size"]) if args["eval"] else None
+    dataloader = dataset.build(Split.TRAIN, args["batch_size"], build_workers=args["build_workers"])
+    dev_dataloader = dataset.build(Split.DEV, args["batch_size"], build_workers=args["build_workers"]) if args["eval"] else None
 
     # Remember the dimensionality that the model will be trained with
     metadata["output-size"] = len(dataset.all_labels)
@@ -129,7 +130,7 @@ def run_experiment(args: dict[str, Any]):
     results.save(args["location"])
 
 if __name__ == '__main__':
-    with log.log_errors, EnvVars(TOKENIZERS_PARALLELISM=str(not "Tue").lower()):
+    with log.log_errors, EnvVars(TOKENIZERS_PARALLELISM="true"):
         parser = Parser(ARGUMENTS, name="daluke-ner", multiple_jobs=True)
         experiments = parser.parse()
         for exp in experiments:
@@ -31,11 +31,14 @@ ARGUMENTS = {
         "type": int,
     },
     "quieter":    {"help": "Don't show debug logging", "action": "store_true"},
+    "fp16":       {"help": "Use mixed precision for forward passing. Requires CUDA", "action": "store_true"},
     **DATASET_ARGUMENTS
 }
 
 def run_experiment(args: dict[str, Any]):
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    if args["fp16"]:
+        assert torch.cuda.is_available(), "Half-precision cannot be used without CUDA access"
     _, metadata, state_dict = load_from_archive(args["model"])
 
     log("Loading dataset ...")
@@ -51,7 +54,7 @@ def run_experiment(args: dict[str, Any]):
     type_distribution(dataset.data[Split.TEST].annotations)
 
     log("Starting evaluation of daLUKE for NER")
-    results = evaluate_ner(model, dataloader, dataset, device, Split.TEST)
+    results = evaluate_ner(model, dataloader, dataset, device, Split.TEST, fp16=args["fp16"])
 
     results.save(args["location"])
     type_distribution(results.preds)
@@ -1,10 +1,13 @@
+from __future__ import annotations
 import os
+import importlib.util
 
 import click
 from itertools import combinations
 
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
+from matplotlib.colors import to_rgba
 import matplotlib as mpl
 from pelutils.ds.plot import rc_params
 
@@ -21,15 +24,58 @@ from daluke.ner.analysis.representation_examples import DUMMY_METADATA
 
 mpl.rcParams.update(rc_params)
 
+# datashader is only imported when used, as importing it is slow
+datashader_available = importlib.util.find_spec("datashader") is not None
+
 COLORS = ["grey", "red", "yellow", "blue", "green"]
+# RGBA value of each label index such that point colours can be looked up at once
+RGBA = np.array([to_rgba(c) for c in COLORS])
 NAMES = (DaNE.null_label, *DaNE.labels)
+# Projections of more points than this are downsampled before plotting
+MAX_POINTS = 20_000
+# The PCA matrix is rendered with datashader instead of drawing individual points above this number of points
+DATASHADER_MIN_POINTS = 10_000
+
+def _stratified_sample(labels: np.ndarray, max_points: int) -> np.ndarray:
+    """ Returns sorted indices of at most around max_points points, where each label keeps its share of the points """
+    rng = np.random.default_rng(0)
+    frac = max_points / len(labels)
+    idcs = list()
+    for label in np.unique(labels):
+        label_idcs = np.flatnonzero(labels == label)
+        idcs.append(rng.choice(label_idcs, size=max(1, round(frac*len(label_idcs))), replace=False))
+    return np.sort(np.concatenate(idcs))
+
+def _point_colours(labels: np.ndarray, max_points: int | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the indices of the null points and entity points to draw and the RGBA colour of each entity point.
+    If there are more than max_points points, a sample stratified by label is drawn
+    """
+    idcs = _stratified_sample(labels, max_points) if max_points is not None and len(labels) > max_points else np.arange(len(labels))
+    nulls = labels[idcs] == 0
+    ent_idcs = idcs[~nulls]
+    rgba = RGBA[labels[ent_idcs]]
+    rgba[:, 3] = .4
+    return idcs[nulls], ent_idcs, rgba
+
+def _scatter_transformed(Z1: np.ndarray, Z2: np.ndarray, null_idcs: np.ndarray, ent_idcs: np.ndarray, ent_rgba: np.ndarray, axis):
+    # Point indices and colours are given by _point_colours, so they can be reused between plots
+    # Nulls all have the same colour, so they are drawn with plot which is faster than scatter.
+    # They are given the same zorder as the scatter collection, so they are drawn below the entities
+    axis.plot(Z1[null_idcs], Z2[null_idcs], "o", color=COLORS[0], alpha=.1, markeredgewidth=0, zorder=1, rasterized=True)
+    axis.scatter(Z1[ent_idcs], Z2[ent_idcs], c=ent_rgba, edgecolors="none", rasterized=True)
+    axis.grid()
 
-def _scatter_transformed(Z1: np.ndarray, Z2: np.ndarray, labels: np.ndarray, axis):
-    cdict = dict(enumerate(COLORS))
-
-    nulls = labels == 0
-    axis.scatter(Z1[nulls], Z2[nulls], c=COLORS[0], alpha=.1)
-    axis.scatter(Z1[~nulls], Z2[~nulls], c=[cdict[l] for l in labels[~nulls]], alpha=.4)
+def _shade_transformed(Z1: np.ndarray, Z2: np.ndarray, labels: np.ndarray, axis, size=400):
+    # Render the points as an image coloured by label. This takes time proportional to the number of pixels rather than points
+    import datashader as ds
+    import datashader.transfer_functions as tf
+    import pandas as pd
+    df = pd.DataFrame(dict(x=Z1, y=Z2, label=pd.Categorical(labels, categories=range(len(COLORS)))))
+    x_range, y_range = (Z1.min(), Z1.max()), (Z2.min(), Z2.max())
+    agg = ds.Canvas(plot_width=size, plot_height=size, x_range=x_range, y_range=y_range).points(df, "x", "y", ds.count_cat("label"))
+    img = tf.spread(tf.shade(agg, color_key=COLORS), px=1)
+    axis.imshow(img.to_pil(), extent=(*x_range, *y_range), aspect="auto")
     axis.grid()
 
 def _get_h_l(only_pos: bool):
@@ -41,12 +87,15 @@ def _get_h_l(only_pos: bool):
         l.pop(0)
     return h, l
 
-def pca_explained_plot(location: str):
-    lambdas = GeometryResults.load().principal_components
+def pca_explained_plot(location: str, res: GeometryResults):
+    lambdas = res.principal_components
     show_k = 100
 
+    # Only the cumulative sum of the shown components is needed
+    explained = np.cumsum(lambdas[:show_k]) / lambdas.sum() * 100
+
     _, ax = plt.subplots(figsize=figsize_std)
-    ax.plot(range(0, show_k+1), [0, *np.cumsum(lambdas)[:show_k]/np.sum(lambdas)*100], color=tab_colours[0], linestyle="--", marker=".")
+    ax.plot(range(0, len(explained)+1), np.concatenate(([0], explained)), color=tab_colours[0], linestyle="--", marker=".")
     ax.set_xlabel("Number of principal components")
     ax.set_ylabel("Data variance explained [%]")
     ax.set_title("PCA on DaLUKE Representations for DaNE")
@@ -57,35 +106,41 @@ def pca_explained_plot(location: str):
     plt.savefig(os.path.join(location, "geometry-plots", "variance_explained.png"))
     plt.close()
 
-def pca_matrix_plot(location: str):
-    res = GeometryResults.load()
+def pca_matrix_plot(location: str, res: GeometryResults):
     only_pos = not (res.labels == 0).any()
     V = res.pca_transformed
     N = 4
 
-    fig, axes = plt.subplots(N-1, N-1, figsize=(20, 20))
+    use_datashader = datashader_available and len(V) > DATASHADER_MIN_POINTS
+    colours = None if use_datashader else _point_colours(res.labels, MAX_POINTS)
+    # Each column shows the same PC on the x axis and each row the same PC on the y axis, so ticks are shared
+    fig, axes = plt.subplots(N-1, N-1, figsize=(20, 20), sharex="col", sharey="row")
     remaining_axes = list(axes.ravel())
     # j, i are switched around to get lower triangle
     for (j, i) in combinations(range(N), 2):
         ax = axes[i-1, j]
-        _scatter_transformed(V[:, j], V[:, i], res.labels, ax)
-        ax.set_xlabel(f"PC {j+1}")
-        ax.set_ylabel(f"PC {i+1}")
+        if use_datashader:
+            _shade_transformed(V[:, j], V[:, i], res.labels, ax)
+        else:
+            _scatter_transformed(V[:, j], V[:, i], *colours, ax)
+        if i == N-1:
+            ax.set_xlabel(f"PC {j+1}")
+        if j == 0:
+            ax.set_ylabel(f"PC {i+1}")
         remaining_axes.remove(ax)
-    # Make unused axes invisible
+    # Remove unused axes, so they are not drawn
     for ax in remaining_axes:
-        ax.set_axis_off()
+        fig.delaxes(ax)
     fig.legend(*_get_h_l(only_pos), "center right", prop=dict(size=35))
     fig.suptitle("PCA Space of DaLUKE Representations for DaNE", size="xx-large")
     plt.tight_layout()
     plt.savefig(os.path.join(location, "geometry-plots", "pca_matrix.png"))
     plt.close()
 
-def umap_plot(location: str):
-    res = GeometryResults.load()
+def umap_plot(location: str, res: GeometryResults):
     only_pos = not (res.labels == 0).any()
     _, ax = plt.subplots(figsize=figsize_std)
-    _scatter_transformed(res.umap_transformed[:, 0], res.umap_transformed[:, 1], res.labels[:len(res.umap_transformed)], ax)
+    _scatter_transformed(res.umap_transformed[:, 0], res.umap_transformed[:, 1], *_point_colours(res.labels[:len(res.umap_transformed)], MAX_POINTS), ax)
     ax.legend(*_get_h_l(only_pos), loc="lower left")
     ax.set_title("UMAP Space of DaLUKE Representations for DaNE")
 
@@ -93,11 +148,10 @@ def umap_plot(location: str):
     plt.savefig(os.path.join(location, "geometry-plots", "umap.png"))
     plt.close()
 
-def tsne_plot(location: str):
-    res = GeometryResults.load()
+def tsne_plot(location: str, res: GeometryResults):
     only_pos = not (res.labels == 0).any()
     _, ax = plt.subplots(figsize=figsize_std)
-    _scatter_transformed(res.tsne_transformed[:, 0], res.tsne_transformed[:, 1], res.labels[:len(res.tsne_transformed)], ax)
+    _scatter_transformed(res.tsne_transformed[:, 0], res.tsne_transformed[:, 1], *_point_colours(res.labels[:len(res.tsne_transformed)], MAX_POINTS), ax)
     ax.legend(*_get_h_l(only_pos), loc="lower left")
     ax.set_title("t-SNE Space of DaLUKE Representations for DaNE")
 
@@ -105,46 +159,54 @@ def tsne_plot(location: str):
     plt.savefig(os.path.join(location, "geometry-plots", "tsne.png"))
     plt.close()
 
-def plots_vs_length(location: str):
-    res = GeometryResults.load()
+def plots_vs_length(location: str, res: GeometryResults):
     only_pos = not (res.labels == 0).any()
     # Hardcoded to train
     log.debug("Loading data...")
     data = load_dataset(dict(dataset="DaNE"), DUMMY_METADATA, torch.device("cpu")).data[Split.TRAIN]
-    seq_lengths =  np.array([len(data.texts[c["text_num"]]) for c in res.content])
-    span_lengths = np.array([c["span"][1] - c["span"][0] for c in res.content])
+    # Gather the length of the text of each example from an array of all text lengths
+    text_lengths = np.fromiter((len(t) for t in data.texts), dtype=int, count=len(data.texts))
+    text_nums = np.fromiter((c["text_num"] for c in res.content), dtype=int, count=len(res.content))
+    seq_lengths = text_lengths[text_nums]
+    spans = np.array([c["span"] for c in res.content], dtype=int).reshape(-1, 2)
+    span_lengths = spans[:, 1] - spans[:, 0]
     N = 4
+    # All plots are drawn on the same figure, which is cleared between plots
+    fig, ax = plt.subplots(figsize=figsize_std)
     for name, Z in zip(("PCA", "t-SNE", "UMAP"), (res.pca_transformed, res.tsne_transformed, res.umap_transformed)):
+        colours = _point_colours(res.labels[:len(Z)])
         for dim in range(min(Z.shape[1], N)):
             for lenname, lengths in zip(("sequence", "span"), (seq_lengths, span_lengths)):
                 log.debug(f"Plotting {name}{dim} on {lenname}")
-                _, ax = plt.subplots(figsize=figsize_std)
+                ax.cla()
                 ax.set_title(f"{name} Representations, Dim. {dim+1} vs. Example {lenname.title()} Length")
                 Z_ = Z[:, dim]
-                _scatter_transformed(lengths[:len(Z_)], Z_, res.labels[:len(Z_)], ax)
+                _scatter_transformed(lengths[:len(Z_)], Z_, *colours, ax)
                 ax.legend(*_get_h_l(only_pos), loc="lower right")
                 ax.set_ylabel(f"{name}$_{dim+1}$")
                 ax.set_xlabel(f"Entity Example {lenname.title()} Length")
 
-                plt.tight_layout()
-                plt.savefig(os.path.join(location, "geometry-plots", f"{name}{dim}-{lenname}-len.png"))
-                plt.close()
+                fig.tight_layout()
+                fig.savefig(os.path.join(location, "geometry-plots", f"{name}{dim}-{lenname}-len.png"))
+    plt.close(fig)
 
 @click.command()
 @click.argument("location")
 def make_representation_plots(location: str):
     log.configure(os.path.join(location, "geometry-plots", "representations-plots.log"), "Visualizing contextualized represenations on NER")
     GeometryResults.subfolder = location
+    # Load results once and share them between all plots
+    res = GeometryResults.load()
     log("PCA matrix plot")
-    pca_matrix_plot(location)
+    pca_matrix_plot(location, res)
     log("PCA explained plot")
-    pca_explained_plot(location)
+    pca_explained_plot(location, res)
     log("UMAP plot")
-    umap_plot(location)
+    umap_plot(location, res)
     log("t-SNE plot")
-    tsne_plot(location)
+    tsne_plot(location, res)
     log("plots vs. length")
-    plots_vs_length(location)
+    plots_vs_length(location, res)
 
 if __name__ == "__main__":
     with log.log_errors:
@@ -370,16 +370,7 @@ def train(
             sampler.set_epoch(i)
 
         # Allocate room for results for this epoch
-        res.losses       = np.vstack((res.losses,       np.zeros(num_updates_epoch)))
-        res.w_losses     = np.vstack((res.w_losses,     np.zeros(num_updates_epoch)))
-        res.e_losses     = np.vstack((res.e_losses,     np.zeros(num_updates_epoch)))
-        res.scaled_loss  = np.vstack((res.scaled_loss,  np.zeros(num_updates_epoch)))
-        res.lr           = np.vstack((res.lr,           np.zeros(num_updates_epoch)))
-        res.w_accuracies = np.concatenate((res.w_accuracies, np.full((1, num_updates_epoch, len(res.top_k)), np.nan)))
-        res.e_accuracies = np.concatenate((res.e_accuracies, np.full((1, num_updates_epoch, len(res.top_k)), np.nan)))
-        res.param_diff_1 = np.vstack((res.param_diff_1, np.zeros(num_updates_epoch)))
-        res.param_diff_2 = np.vstack((res.param_diff_2, np.zeros(num_updates_epoch)))
-        res.runtime      = np.vstack((res.runtime,      np.zeros(num_updates_epoch)))
+        res.add_epoch()
 
         batch_iter = iter(loader)
 
@@ -388,9 +379,10 @@ def train(
             TT.profile("Parameter update")
 
             # Losses and accuracies for this parameter update
-            t_loss, w_loss, e_loss, s_loss = 0, 0, 0, 0
-            w_accuracies = np.full((grad_accumulation_steps, len(res.top_k)), np.nan)
-            e_accuracies = np.full((grad_accumulation_steps, len(res.top_k)), np.nan)
+            # These are kept on device, such that synchronization only happens once per parameter update
+            t_loss, w_loss, e_loss, s_loss = (torch.zeros((), device=device) for _ in range(4))
+            w_accuracies = torch.full((grad_accumulation_steps, len(res.top_k)), np.nan, device=device)
+            e_accuracies = torch.full((grad_accumulation_steps, len(res.top_k)), np.nan, device=device)
 
             # Loop over enough batches to make a parameter update
             for k in range(grad_accumulation_steps):
@@ -411,13 +403,13 @@ def train(
                     if params.fp16:
                         scaled_loss = scaler.scale(loss)
                         scaled_loss.backward()
-                        s_loss += scaled_loss.item()
+                        s_loss += scaled_loss.detach()
                     else:
                         loss.backward()
 
-                t_loss += loss.item()
-                w_loss += word_loss.item() / grad_accumulation_steps
-                e_loss += ent_loss.item() / grad_accumulation_steps
+                t_loss += loss.detach()
+                w_loss += word_loss.detach() / grad_accumulation_steps
+                e_loss += ent_loss.detach() / grad_accumulation_steps
 
                 if torch.cuda.is_available() and is_distributed:
                     torch.cuda.synchronize(rank if is_distributed else None)
@@ -446,19 +438,20 @@ def train(
             # Calculate how much gradient has changed
             with TT.profile("Parameter changes"), torch.no_grad():
                 if is_master:
-                    orig_pars = torch.from_numpy(res.orig_params).to(device)
                     current_pars = all_params(model.module if is_distributed else model)
-                    res.param_diff_1[i, j] = torch.abs(current_pars-orig_pars).sum().item()
-                    res.param_diff_2[i, j] = torch.sqrt(((current_pars-orig_pars)**2).sum()).item()
-                    del orig_pars
+                    res.param_diff_1[i, j], res.param_diff_2[i, j] = TrainResults.param_diffs(current_pars, res.orig_params)
+
+            # Reduce accuracies on device, ignoring top k's that were not calculated, and synchronize once
+            w_accuracies = w_accuracies.nansum(dim=0) / (~w_accuracies.isnan()).sum(dim=0)
+            e_accuracies = e_accuracies.nansum(dim=0) / (~e_accuracies.isnan()).sum(dim=0)
+            t_loss, w_loss, e_loss, s_loss = torch.stack((t_loss, w_loss, e_loss, s_loss)).tolist()
 
             res.losses[i, j] = t_loss
             res.w_losses[i, j] = w_loss
             res.e_losses[i, j] = e_loss
             res.scaled_loss[i, j] = s_loss
             res.lr[i, j] = scheduler.get_last_lr()[0]
-            res.w_accuracies[i, j] = np.nanmean(w_accuracies, axis=0)
-            res.e_accuracies[i, j] = np.nanmean(e_accuracies, axis=0)
+            res.w_accuracies[i, j], res.e_accuracies[i, j] = torch.stack((w_accuracies, e_accuracies)).cpu().numpy()
             log.debug(
                 "Performed parameter update %i / %i (ep. %i)" % (j, num_updates_epoch-1, i),
                 f"Loss (total, word, entity, scaled): {t_loss:10.5f}, {w_loss:10.5f}, {e_loss:10.5f}, {s_loss:10.5f}",
@@ -0,0 +1,26 @@
+import pytest
+
+from daluke.ner.data import DaNE
+
+def _dataset(max_seq_length: int) -> DaNE:
+    # Avoid __init__, as it downloads a tokenizer which is not needed for splitting sentences
+    dataset = object.__new__(DaNE)
+    dataset.max_seq_length = max_seq_length
+    return dataset
+
+def test_extra_sentence_boundaries():
+    dataset = _dataset(6)
+    token_ids = [[1], [1, 2], [1], [1], [1, 2, 3], [1]]
+    # Fits within limit of 4 subwords excluding start and end tokens
+    assert dataset._add_extra_sentence_boundaries([2, 3], token_ids[:3]) == [2, 3]
+    # Sentence of 9 subwords is split twice
+    bounds = [6]
+    assert dataset._add_extra_sentence_boundaries(bounds, token_ids) == [2, 4, 6]
+    # Input is not modified
+    assert bounds == [6]
+
+def test_extra_sentence_boundaries_long_word():
+    dataset = _dataset(6)
+    # Second word alone has more subwords than allowed
+    with pytest.raises(AssertionError):
+        dataset._add_extra_sentence_boundaries([3], [[1], [1, 2, 3, 4, 5], [1]])
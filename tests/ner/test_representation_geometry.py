@@ -0,0 +1,20 @@
+import numpy as np
+
+from daluke.ner.analysis.representation_geometry import GeometryResults
+
+def test_save_load(tmp_path):
+    res = GeometryResults(
+        pca_transformed      = np.random.randn(10, 4),
+        umap_transformed     = np.random.randn(10, 2),
+        tsne_transformed     = np.random.randn(10, 2),
+        labels               = np.arange(10),
+        principal_components = np.random.randn(4, 8),
+        content              = [dict(sentence=1, spans=[[0, 2]])],
+    )
+    res.save(tmp_path)
+    loaded = GeometryResults.load(tmp_path)
+    for field in ("pca_transformed", "umap_transformed", "tsne_transformed", "labels", "principal_components"):
+        # Arrays are memory-mapped instead of read into memory
+        assert isinstance(getattr(loaded, field), np.memmap)
+        assert np.array_equal(getattr(loaded, field), getattr(res, field))
+    assert loaded.content == res.content
@@ -0,0 +1,87 @@
+from __future__ import annotations
+import os
+
+import numpy as np
+import torch
+
+from daluke.analysis.pretrain import TrainResults, top_k_accuracy
+
+def test_top_k_accuracy():
+    scores = torch.Tensor([
+        [0.1, 0.5, 0.3, 0.0],
+        [0.9, 0.2, 0.4, 0.1],
+        [0.2, 0.1, 0.3, 0.6],
+    ])
+    labels = torch.LongTensor([1, 2, 1])
+    scores_copy = scores.clone()
+    accs = top_k_accuracy(labels, scores, [1, 2, 3, 4])
+    assert np.allclose(accs, [1/3, 2/3, 2/3, 1])
+    # Scores should not be modified
+    assert torch.equal(scores, scores_copy)
+    # Asking for more than the number of classes should not fail
+    assert np.allclose(top_k_accuracy(labels, scores, [1, 10]), [1/3, 1])
+    # Only top 1
+    assert np.allclose(top_k_accuracy(labels, scores, [1]), [1/3])
+
+def _results(orig_params: np.ndarray | None) -> TrainResults:
+    return TrainResults(
+        losses       = np.zeros((0, 3)),
+        w_losses     = np.zeros((0, 3)),
+        e_losses     = np.zeros((0, 3)),
+        scaled_loss  = np.zeros((0, 3)),
+        runtime      = np.zeros((0, 3)),
+        lr           = np.zeros((0, 3)),
+        epoch        = 0,
+        top_k        = [1, 5],
+        w_accuracies = np.zeros((0, 3, 2)),
+        e_accuracies = np.zeros((0, 3, 2)),
+        orig_params  = orig_params,
+        param_diff_1 = np.zeros((0, 3)),
+        param_diff_2 = np.zeros((0, 3)),
+        luke_exclusive_params = set(),
+        q_mats_from_base      = set(),
+    )
+
+def test_add_epoch():
+    res = _results(None)
+    res.add_epoch()
+    res.add_epoch()
+    assert res.losses.shape == res.runtime.shape == (2, 3)
+    assert res.w_accuracies.shape == (2, 3, 2)
+    assert np.isnan(res.e_accuracies).all()
+
+def test_param_diffs():
+    orig = np.random.randn(1000).astype(np.float32)
+    current = torch.from_numpy(orig) + torch.randn(1000)
+    diff = (current - torch.from_numpy(orig)).double()
+    # Chunk size that does not divide the number of parameters
+    norm1, norm2 = TrainResults.param_diffs(current, orig, chunk=300)
+    assert np.isclose(norm1, diff.abs().sum().item())
+    assert np.isclose(norm2, diff.norm().item())
+
+def test_save_load(tmp_path):
+    orig = np.random.randn(100).astype(np.float32)
+    res = _results(orig.copy())
+    res.add_epoch()
+    res.losses[0] = 1
+    res.luke_exclusive_params = {"ent_embeds"}
+    res.save(tmp_path)
+    # Original parameters are memory-mapped after the first save
+    assert isinstance(res.orig_params, np.memmap)
+    path = os.path.join(tmp_path, "orig_params.npy")
+    # Set an old modification time, so any rewrite is detected regardless of timestamp resolution
+    os.utime(path, ns=(0, 0))
+    # Saving again to the same location should not rewrite the original parameters
+    paths = res.save(tmp_path)
+    assert path in paths
+    assert os.stat(path).st_mtime_ns == 0
+    assert os.path.samefile(res.orig_params.filename, path)
+
+    loaded = TrainResults.load(tmp_path)
+    assert isinstance(loaded.orig_params, np.memmap)
+    assert np.array_equal(loaded.orig_params, orig)
+    assert np.array_equal(loaded.losses, res.losses)
+    assert np.array_equal(loaded.w_accuracies, res.w_accuracies, equal_nan=True)
+    assert loaded.top_k == [1, 5]
+    assert loaded.epoch == 0
+    assert loaded.luke_exclusive_params == {"ent_embeds"}
@@ -1,3 +1,4 @@
+import pytest
 import torch
 from transformers import AutoTokenizer
 
@@ -5,13 +6,26 @@ from daluke.data import Words, Entities, Example
 from . import features_from_str
 from daluke import daBERT
 
+# Expected results are built once when the module is imported
+EXPECTED_WORD_IDS = torch.IntTensor([2, 22, 48,  99,  3,  0,  0,  0,  0,  0])
+EXPECTED_WORD_MASK = torch.IntTensor([1, 1, 1, 1, 1, 0, 0, 0, 0, 0])
+EXPECTED_ENT_IDS = torch.IntTensor([69, 420, 42060, 0, 0])
+EXPECTED_ENT_MASK = torch.IntTensor([1, 1, 1, 0, 0])
+EXPECTED_ENT_POS = torch.IntTensor([
+    [ 1,  2, -1, -1],
+    [ 3, -1, -1, -1],
+    [-1, -1, -1, -1],
+    [-1, -1, -1, -1],
+    [-1, -1, -1, -1],
+])
+
 def test_words():
     words = Words.build(
         torch.IntTensor([22, 48, 99]),
         max_len=10,
     )
-    assert torch.equal(words.ids, torch.IntTensor([2, 22, 48,  99,  3,  0,  0,  0,  0,  0]))
-    assert torch.equal(words.attention_mask, torch.IntTensor([1, 1, 1, 1, 1, 0, 0, 0, 0, 0]))
+    assert torch.equal(words.ids, EXPECTED_WORD_IDS)
+    assert torch.equal(words.attention_mask, EXPECTED_WORD_MASK)
 
 def test_entities():
     ents = Entities.build(
@@ -20,16 +34,11 @@ def test_entities():
         max_entities=5,
         max_entity_span=4,
     )
-    assert torch.equal(ents.ids, torch.IntTensor([69, 420, 42060, 0, 0]))
-    assert torch.equal(ents.attention_mask, torch.IntTensor([1, 1, 1, 0, 0]))
-    assert torch.equal(ents.pos,
-        torch.IntTensor([[ 1,  2, -1, -1],
-            [ 3, -1, -1, -1],
-            [-1, -1, -1, -1],
-            [-1, -1, -1, -1],
-            [-1, -1, -1, -1]]
-        )
-    )
+    assert torch.equal(ents.ids, EXPECTED_ENT_IDS)
+    assert torch.equal(ents.attention_mask, EXPECTED_ENT_MASK)
+    assert torch.equal(ents.pos, EXPECTED_ENT_POS)
+    with pytest.raises(AssertionError):
+        Entities.build(torch.IntTensor([69]), [(0, 6)], max_entities=8, max_entity_span=4)
 
 def test_create_features():
     ent_vocab = {"[UNK]": 1, "Danmark": 42}